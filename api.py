@@ -1,48 +1,168 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Request, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from typing import List, Optional
+from contextlib import asynccontextmanager
 import rag
+import os
+import re
+import sys
 import shutil
+import tempfile
+import asyncio
+import aiofiles
+import msgspec
 from pathlib import Path
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load models and open the vector store before accepting requests
+    await asyncio.to_thread(rag.warm_up)
+    yield
+    await rag.close_components()
+
+
 app = FastAPI(
     title="Document Intelligence API",
     description="RAG-based API for querying documents (PDF, CSV, DOCX, TXT)",
-    version="2.0.0"
+    version="2.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
-# CORS middleware for chatbot UI integration
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Configure for production
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+
+class CORSHeadersMiddleware:
+    """
+    Pure ASGI CORS middleware for chatbot UI integration.
+    Allows any origin (configure for production) without Starlette's
+    per-request header matching.
+    """
+
+    ALLOW_METHODS = b"DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        origin = request_method = request_headers = None
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value
+            elif name == b"access-control-request-method":
+                request_method = value
+            elif name == b"access-control-request-headers":
+                request_headers = value
+
+        if origin is None:
+            await self.app(scope, receive, send)
+            return
+
+        # Echo the origin so credentialed requests are accepted by browsers
+        cors_headers = [
+            (b"access-control-allow-origin", origin),
+            (b"access-control-allow-credentials", b"true"),
+            (b"vary", b"Origin"),
+        ]
+
+        if scope["method"] == "OPTIONS" and request_method is not None:
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": cors_headers + [
+                    (b"access-control-allow-methods", self.ALLOW_METHODS),
+                    (b"access-control-allow-headers", request_headers or b"*"),
+                    (b"access-control-max-age", b"600"),
+                    (b"content-length", b"0"),
+                ]
+            })
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        response_started = False
+
+        async def send_with_cors(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+                message["headers"] = list(message.get("headers", [])) + cors_headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_cors)
+        except Exception as exc:
+            # Exception handlers run outside this middleware, so build the
+            # 500 here to keep CORS headers on it; re-raise for server logging
+            if response_started:
+                raise
+            await _error_response(exc)(scope, receive, send_with_cors)
+            raise
+
+
+app.add_middleware(CORSHeadersMiddleware)
+
+
+@app.exception_handler(rag.KnowledgeBaseNotReady)
+async def knowledge_base_not_ready(request: Request, exc: rag.KnowledgeBaseNotReady):
+    return ORJSONResponse(status_code=400, content={"detail": str(exc)})
+
+
+def _error_response(exc: Exception) -> ORJSONResponse:
+    return ORJSONResponse(status_code=500, content={"detail": f"Internal error: {str(exc)}"})
+
+
+@app.exception_handler(Exception)
+async def unhandled_error(request: Request, exc: Exception):
+    return _error_response(exc)
+
 
 # Temporary storage for uploaded files
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
+UPLOAD_CHUNK_SIZE = 1 << 20
 
 
-class QueryRequest(BaseModel):
+# Decoded with msgspec on the hot query path instead of Pydantic
+class QueryRequest(msgspec.Struct):
     query: str
 
-    class Config:
-        json_schema_extra = {
-            "example": {
-                "query": "What are the key findings in the report?"
-            }
-        }
-
 
-class QueryResponse(BaseModel):
+class QueryResponse(msgspec.Struct):
     answer: str
     sources: str
     confidence: Optional[str] = None
 
 
+_, _query_schemas = msgspec.json.schema_components([QueryRequest, QueryResponse])
+
+QUERY_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {
+                "schema": _query_schemas["QueryRequest"],
+                "example": {
+                    "query": "What are the key findings in the report?"
+                }
+            }
+        }
+    },
+    "responses": {
+        "200": {
+            "description": "Successful Response",
+            "content": {
+                "application/json": {"schema": _query_schemas["QueryResponse"]}
+            }
+        }
+    }
+}
+
+
 class ProcessResponse(BaseModel):
     message: str
     files_processed: int
@@ -71,6 +191,42 @@ class ChatResponse(BaseModel):
     conversation_id: Optional[str] = None
 
 
+def _sendfile(source, file_path: Path):
+    """Copy a spooled temp file to disk inside the kernel"""
+    source.flush()
+    in_fd = source.fileno()
+    size = os.fstat(in_fd).st_size
+
+    with file_path.open("wb") as buffer:
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(buffer.fileno(), in_fd, offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+
+
+async def _save_upload(file: UploadFile, file_path: Path):
+    """Stream an upload to disk without blocking the event loop"""
+    # Large uploads are already spooled to a temp file by Starlette.
+    # File-to-file sendfile only works on Linux (macOS needs a socket target).
+    if getattr(file.file, "_rolled", False) and sys.platform.startswith("linux"):
+        await asyncio.to_thread(_sendfile, file.file, file_path)
+        return
+
+    async with aiofiles.open(file_path, "wb") as buffer:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await buffer.write(chunk)
+
+
+def _process_documents(file_paths: List[str]) -> List[str]:
+    status_messages = []
+    for message in rag.process_documents(file_paths):
+        status_messages.append(message)
+        print(f"Processing: {message}")
+    return status_messages
+
+
 @app.get("/")
 async def root():
     return {
@@ -115,8 +271,12 @@ async def upload_documents(
     allowed_extensions = {".pdf", ".csv", ".xlsx", ".docx", ".txt"}
     uploaded_paths = []
 
+    # Per-request directory with one subdirectory per file, so files saved
+    # concurrently never share a path even when their names match
+    request_dir = Path(tempfile.mkdtemp(dir=UPLOAD_DIR))
+
     try:
-        for file in files:
+        for i, file in enumerate(files):
             file_ext = Path(file.filename).suffix.lower()
             if file_ext not in allowed_extensions:
                 raise HTTPException(
@@ -124,18 +284,18 @@ async def upload_documents(
                     detail=f"Unsupported file type: {file_ext}. Allowed: {allowed_extensions}"
                 )
 
-            # Save uploaded file
-            file_path = UPLOAD_DIR / file.filename
-            with file_path.open("wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
+            file_dir = request_dir / str(i)
+            file_dir.mkdir()
+            uploaded_paths.append(str(file_dir / Path(file.filename).name))
 
-            uploaded_paths.append(str(file_path))
+        # Save uploaded files concurrently
+        await asyncio.gather(
+            *[_save_upload(file, Path(path)) for file, path in zip(files, uploaded_paths)]
+        )
 
-        # Process documents through RAG pipeline
-        status_messages = []
-        for message in rag.process_documents(uploaded_paths):
-            status_messages.append(message)
-            print(f"Processing: {message}")
+        # Parse (in parallel worker processes), embed and store through the
+        # RAG pipeline without blocking the event loop
+        status_messages = await asyncio.to_thread(_process_documents, uploaded_paths)
 
         # Extract final status
         final_status = status_messages[-1] if status_messages else "Processing completed"
@@ -155,39 +315,48 @@ async def upload_documents(
             status=final_status
         )
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
     finally:
         # Cleanup uploaded files
-        for path in uploaded_paths:
-            try:
-                Path(path).unlink(missing_ok=True)
-            except:
-                pass
+        shutil.rmtree(request_dir, ignore_errors=True)
 
 
-@app.post("/v1/query", response_model=QueryResponse)
-async def query_documents(request: QueryRequest):
+def _validation_errors(exc: msgspec.DecodeError) -> List[dict]:
+    """Map a msgspec decode error to FastAPI's [{type, loc, msg}] error list"""
+    if not isinstance(exc, msgspec.ValidationError):
+        return [{"type": "json_invalid", "loc": ["body"], "msg": "JSON decode error", "ctx": {"error": str(exc)}}]
+
+    message, _, path = str(exc).partition(" - at `$")
+    loc = ["body"] + [int(part) if part.isdigit() else part for part in re.split(r"[.\[\]`]", path) if part]
+
+    missing = re.fullmatch(r"Object missing required field `(.+)`", message)
+    if missing:
+        return [{"type": "missing", "loc": loc + [missing.group(1)], "msg": "Field required"}]
+
+    return [{"type": "value_error", "loc": loc, "msg": message}]
+
+
+@app.post("/v1/query", openapi_extra=QUERY_OPENAPI)
+async def query_documents(raw_request: Request):
     """
     Query the knowledge base with natural language questions.
     Returns answers grounded in uploaded documents.
     """
+    try:
+        request = msgspec.json.decode(await raw_request.body(), type=QueryRequest)
+    except msgspec.DecodeError as e:
+        raise RequestValidationError(_validation_errors(e))
+
     if not request.query or not request.query.strip():
         raise HTTPException(status_code=400, detail="Query cannot be empty")
 
-    try:
-        answer, sources = rag.generate_answer(request.query)
+    answer, sources = await rag.generate_answer(request.query)
 
-        return QueryResponse(
-            answer=answer,
-            sources=sources,
-            confidence="high" if sources and "No sources" not in sources else "low"
-        )
-
-    except RuntimeError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Query error: {str(e)}")
+    response = QueryResponse(
+        answer=answer,
+        sources="\n".join(f"- {src}" for src in sources),
+        confidence="high" if sources else "low"
+    )
+    return Response(content=msgspec.json.encode(response), media_type="application/json")
 
 
 @app.post("/v1/chat", response_model=ChatResponse)
@@ -199,24 +368,13 @@ async def chat_interface(message: ChatMessage):
     if not message.message or not message.message.strip():
         raise HTTPException(status_code=400, detail="Message cannot be empty")
 
-    try:
-        answer, sources = rag.generate_answer(message.message)
-
-        # Parse sources into list format for chatbot UI
-        source_list = []
-        if sources and "No sources" not in sources:
-            source_list = [s.strip("- ").strip() for s in sources.split("\n") if s.strip()]
-
-        return ChatResponse(
-            reply=answer,
-            sources=source_list,
-            conversation_id=message.conversation_id
-        )
+    answer, sources = await rag.generate_answer(message.message)
 
-    except RuntimeError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
+    return ChatResponse(
+        reply=answer,
+        sources=sources,
+        conversation_id=message.conversation_id
+    )
 
 
 @app.delete("/v1/reset")
@@ -225,20 +383,18 @@ async def reset_knowledge_base():
     Clear all documents from the knowledge base.
     Use with caution in production environments.
     """
-    try:
-        if rag.vector_store:
-            rag.vector_store.reset_collection()
-            return {
-                "message": "Knowledge base cleared successfully",
-                "status": "reset_complete"
-            }
-        else:
-            return {
-                "message": "No knowledge base to reset",
-                "status": "not_initialized"
-            }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Reset error: {str(e)}")
+    if rag.vector_store:
+        # May wait for an in-progress upload to finish
+        await asyncio.to_thread(rag.reset_knowledge_base)
+        return {
+            "message": "Knowledge base cleared successfully",
+            "status": "reset_complete"
+        }
+    else:
+        return {
+            "message": "No knowledge base to reset",
+            "status": "not_initialized"
+        }
 
 
 @app.get("/v1/stats")
@@ -248,7 +404,7 @@ async def get_statistics():
     """
     try:
         if rag.vector_store:
-            count = rag.vector_store._collection.count()
+            count = rag.get_chunk_count()
             return {
                 "total_chunks": count,
                 "status": "initialized" if count > 0 else "empty",
@@ -270,4 +426,17 @@ async def get_statistics():
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Knowledge base state (answer cache, chunk count) lives in each process,
+    # so only scale workers out when uploads are routed to every worker.
+    # Prefer the uvicorn CLI in production: started this way, spawned
+    # parsing workers re-import this script (and rag) as __mp_main__.
+    uvicorn.run(
+        "api:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+        loop="auto" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        log_level="warning",
+        access_log=False
+    )
\ No newline at end of file
@@ -0,0 +1,48 @@
+from pathlib import Path
+from langchain_community.document_loaders import (
+    PyPDFLoader,
+    CSVLoader,
+    UnstructuredExcelLoader,
+    Docx2txtLoader,
+    TextLoader
+)
+
+# Kept free of model/vector store imports: this module is what spawned
+# document parsing workers import.
+
+
+def load_document(file_path: str):
+    """
+    Load document based on file extension.
+    Supports: PDF, CSV, XLSX, DOCX, TXT
+    """
+    file_path = Path(file_path)
+    extension = file_path.suffix.lower()
+
+    try:
+        if extension == ".pdf":
+            loader = PyPDFLoader(str(file_path))
+        elif extension == ".csv":
+            loader = CSVLoader(str(file_path))
+        elif extension == ".xlsx":
+            loader = UnstructuredExcelLoader(str(file_path), mode="elements")
+        elif extension == ".docx":
+            loader = Docx2txtLoader(str(file_path))
+        elif extension == ".txt":
+            loader = TextLoader(str(file_path))
+        else:
+            raise ValueError(f"Unsupported file type: {extension}")
+
+        documents = loader.load()
+
+        # Add filename to metadata
+        for doc in documents:
+            if not hasattr(doc, 'metadata'):
+                doc.metadata = {}
+            doc.metadata['source'] = file_path.name
+            doc.metadata['file_type'] = extension
+
+        return documents
+
+    except Exception as e:
+        raise Exception(f"Error loading {file_path.name}: {str(e)}")
@@ -1,18 +1,23 @@
-from uuid import uuid4
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from dotenv import load_dotenv
 from pathlib import Path
-from typing import List
-from langchain_community.document_loaders import (
-    PyPDFLoader,
-    CSVLoader,
-    UnstructuredExcelLoader,
-    Docx2txtLoader,
-    TextLoader
-)
+from typing import List, Optional, Tuple
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import platform
+import secrets
+import threading
+import httpx
+import numpy as np
+import torch
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_chroma import Chroma
 from langchain_groq import ChatGroq
 from langchain_huggingface.embeddings import HuggingFaceEmbeddings
+from loaders import load_document
 import warnings
 
 warnings.filterwarnings('ignore')
@@ -20,32 +25,228 @@ warnings.filterwarnings('ignore')
 load_dotenv()
 
 # Configuration
-CHUNK_SIZE = 1000
-CHUNK_OVERLAP = 200
+# Sizes are in embedding-model tokens; MiniLM reads 256 including [CLS]/[SEP]
+CHUNK_SIZE = 254
+CHUNK_OVERLAP = 32
 
 EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_BATCH_SIZE = 256
+EMBEDDING_GPU_BATCH_SIZE = 512
+# ONNX Runtime encoder used on CPU. The int8 exports shipped in the model
+# repository are built per CPU architecture; others use the default file.
+EMBEDDING_BACKEND = "onnx"
+EMBEDDING_ONNX_FILES = {
+    "x86_64": "onnx/model_quint8_avx2.onnx",
+    "amd64": "onnx/model_quint8_avx2.onnx",
+    "arm64": "onnx/model_qint8_arm64.onnx",
+    "aarch64": "onnx/model_qint8_arm64.onnx",
+}
+EMBEDDING_ONNX_FILE = EMBEDDING_ONNX_FILES.get(platform.machine().lower(), "onnx/model.onnx")
 VECTORSTORE_DIR = Path(__file__).parent / "resources" / "vectorstore"
 COLLECTION_NAME = "documents_kb"
 
+RETRIEVAL_K = 6
+RELEVANCE_THRESHOLD = 2.5   # Maximum distance for a chunk to count as relevant
+MAX_CONTEXT_DOCS = 5
+FALLBACK_DOCS = 4           # Chunks used when none pass the threshold
+
+# Answer prompt, assembled as HEAD + context + MID + query + TAIL
+PROMPT_HEAD = """You are an intelligent document assistant. Answer the question using ONLY the information from the provided documents.
+
+DOCUMENTS:
+"""
+PROMPT_MID = """
+
+QUESTION: """
+PROMPT_TAIL = """
+
+INSTRUCTIONS:
+- Provide a clear, detailed answer based solely on the document content
+- If the documents contain the information, give a comprehensive response
+- Include specific details, numbers, or facts from the documents when relevant
+- If the information is not in the documents, clearly state: "This information is not available in the uploaded documents"
+- Do not make assumptions or add information not present in the documents
+- If multiple documents discuss the topic, synthesize the information
+
+ANSWER:"""
+
+PARSE_WORKERS = min(4, os.cpu_count() or 1)
+
+GROQ_TIMEOUT = 60
+GROQ_MAX_CONNECTIONS = 100
+GROQ_MAX_KEEPALIVE = 50
+GROQ_KEEPALIVE_EXPIRY = 60
+
+CACHE_MAX_SIZE = 1000
+CACHE_SIMILARITY_THRESHOLD = 0.92
+
 llm = None
 vector_store = None
+text_splitter = None
+# Shared keep-alive HTTP/2 connection pool for Groq calls
+groq_client = None
+# Worker processes for CPU-bound document parsing
+parse_pool = None
+# Cached collection size, refreshed on writes to avoid a count per query
+chunk_count = None
+# Serializes knowledge base rebuilds and resets (re-entrant: rebuilds reset first)
+ingest_lock = threading.RLock()
+
+
+class KnowledgeBaseNotReady(RuntimeError):
+    """Raised when querying before any documents have been processed"""
+
+
+class SemanticCache:
+    """
+    Two-tier cache for generated answers.
+    L1 matches the normalized query text exactly, L2 matches the closest
+    cached query embedding above a cosine similarity threshold.
+    Least recently used entries are evicted once max_size is reached.
+    """
+
+    def __init__(self, max_size: int = CACHE_MAX_SIZE, threshold: float = CACHE_SIMILARITY_THRESHOLD):
+        self.max_size = max_size
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        # Bumped on every clear so answers built before it are not stored
+        self.generation = 0
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            # key -> (slot, answer, sources); slot indexes a row of _vectors
+            self._entries = OrderedDict()
+            self._slot_keys = []
+            self._vectors = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _key(query: str) -> str:
+        normalized = " ".join(query.lower().split())
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def get(self, query: str) -> Optional[Tuple[str, List[str]]]:
+        """Exact (L1) lookup on the normalized query text."""
+        key = self._key(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1], entry[2]
+
+    def search(self, embedding) -> Optional[Tuple[str, List[str]]]:
+        """Semantic (L2) lookup on the query embedding."""
+        vector = self._normalize(embedding)
+        with self._lock:
+            if not self._entries:
+                return None
+            scores = self._vectors[:len(self._slot_keys)] @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            key = self._slot_keys[best]
+            self._entries.move_to_end(key)
+            _, answer, sources = self._entries[key]
+            return answer, sources
+
+    def put(self, query: str, embedding, answer: str, sources: List[str], generation: int):
+        """Store an answer unless the cache was cleared since generation was read."""
+        key = self._key(query)
+        vector = self._normalize(embedding)
+        with self._lock:
+            if generation != self.generation:
+                return
+
+            if key in self._entries:
+                slot = self._entries.pop(key)[0]
+            elif len(self._slot_keys) < self.max_size:
+                slot = len(self._slot_keys)
+                self._slot_keys.append(key)
+            else:
+                # Reuse the slot of the least recently used entry
+                _, (slot, _, _) = self._entries.popitem(last=False)
+
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_size, vector.shape[0]), dtype=np.float32)
+
+            self._vectors[slot] = vector
+            self._slot_keys[slot] = key
+            self._entries[key] = (slot, answer, sources)
+
+
+answer_cache = SemanticCache()
+
+
+def _embedding_config():
+    """
+    Pick the encoder setup for the available hardware.
+    Returns (model_kwargs, batch_size) for HuggingFaceEmbeddings.
+    """
+    if torch.cuda.is_available():
+        torch.backends.cuda.matmul.allow_tf32 = True
+        dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+        return {
+            "trust_remote_code": True,
+            "device": "cuda",
+            "model_kwargs": {"torch_dtype": dtype}
+        }, EMBEDDING_GPU_BATCH_SIZE
+
+    if torch.backends.mps.is_available():
+        return {
+            "trust_remote_code": True,
+            "device": "mps",
+            "model_kwargs": {"torch_dtype": torch.float16}
+        }, EMBEDDING_GPU_BATCH_SIZE
+
+    return {
+        "trust_remote_code": True,
+        "backend": EMBEDDING_BACKEND,
+        "model_kwargs": {"file_name": EMBEDDING_ONNX_FILE}
+    }, EMBEDDING_BATCH_SIZE
 
 
 def initialize_components():
-    """Initialize LLM and vector store"""
-    global llm, vector_store
+    """Initialize LLM, vector store and text splitter"""
+    global llm, vector_store, text_splitter, groq_client
 
     if llm is None:
+        groq_client = httpx.AsyncClient(
+            http2=True,
+            timeout=GROQ_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=GROQ_MAX_CONNECTIONS,
+                max_keepalive_connections=GROQ_MAX_KEEPALIVE,
+                keepalive_expiry=GROQ_KEEPALIVE_EXPIRY
+            )
+        )
         llm = ChatGroq(
             model="llama-3.3-70b-versatile",
             temperature=0.2,
-            max_tokens=1000
+            max_tokens=1000,
+            http_async_client=groq_client
         )
 
     if vector_store is None:
+        model_kwargs, batch_size = _embedding_config()
         embeddings = HuggingFaceEmbeddings(
             model_name=EMBEDDING_MODEL,
-            model_kwargs={"trust_remote_code": True}
+            model_kwargs=model_kwargs,
+            encode_kwargs={
+                "batch_size": batch_size,
+                "normalize_embeddings": True,
+                "convert_to_numpy": True
+            }
         )
 
         vector_store = Chroma(
@@ -54,42 +255,93 @@ def initialize_components():
             persist_directory=str(VECTORSTORE_DIR)
         )
 
+    if text_splitter is None:
+        # Count length in embedding tokens, reusing the encoder's own fast tokenizer
+        text_splitter = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+            vector_store._embedding_function._client.tokenizer,
+            separators=["\n\n", "\n", ". ", "! ", "? ", "; ", ", ", " "],
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP
+        )
 
-def load_document(file_path: str):
+
+def warm_up():
     """
-    Load document based on file extension.
-    Supports: PDF, CSV, XLSX, DOCX, TXT
+    Initialize components and run one embedding and one search so the
+    first request does not pay for model loading or store opening.
     """
-    file_path = Path(file_path)
-    extension = file_path.suffix.lower()
+    initialize_components()
 
-    try:
-        if extension == ".pdf":
-            loader = PyPDFLoader(str(file_path))
-        elif extension == ".csv":
-            loader = CSVLoader(str(file_path))
-        elif extension == ".xlsx":
-            loader = UnstructuredExcelLoader(str(file_path), mode="elements")
-        elif extension == ".docx":
-            loader = Docx2txtLoader(str(file_path))
-        elif extension == ".txt":
-            loader = TextLoader(str(file_path))
-        else:
-            raise ValueError(f"Unsupported file type: {extension}")
-
-        documents = loader.load()
-
-        # Add filename to metadata
-        for doc in documents:
-            if not hasattr(doc, 'metadata'):
-                doc.metadata = {}
-            doc.metadata['source'] = file_path.name
-            doc.metadata['file_type'] = extension
-
-        return documents
+    query_embedding = vector_store._embedding_function.embed_query("warmup")
 
-    except Exception as e:
-        raise Exception(f"Error loading {file_path.name}: {str(e)}")
+    if get_chunk_count() > 0:
+        vector_store._collection.query(
+            query_embeddings=[query_embedding],
+            n_results=1,
+            include=["distances"]
+        )
+
+
+def get_parse_pool() -> ProcessPoolExecutor:
+    """Return the shared document parsing pool, starting it on first use"""
+    global parse_pool
+
+    # A crashed worker marks the whole pool broken; replace it
+    if parse_pool is not None and getattr(parse_pool, "_broken", False):
+        parse_pool.shutdown(wait=False, cancel_futures=True)
+        parse_pool = None
+
+    if parse_pool is None:
+        # Spawn fresh workers rather than forking a process that already
+        # holds loaded models and running threads
+        parse_pool = ProcessPoolExecutor(
+            max_workers=PARSE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+
+    return parse_pool
+
+
+async def close_components():
+    """Close the Groq connection pool and the parsing workers"""
+    global llm, groq_client, parse_pool
+
+    if groq_client is not None:
+        await groq_client.aclose()
+        groq_client = None
+        llm = None
+
+    if parse_pool is not None:
+        parse_pool.shutdown(cancel_futures=True)
+        parse_pool = None
+
+
+def get_chunk_count() -> int:
+    """Return the number of stored chunks, querying Chroma only when unknown"""
+    global chunk_count
+
+    if chunk_count is None:
+        chunk_count = vector_store._collection.count()
+
+    return chunk_count
+
+
+def refresh_chunk_count() -> int:
+    """Re-read the number of stored chunks after a write"""
+    global chunk_count
+
+    chunk_count = None
+    return get_chunk_count()
+
+
+def reset_knowledge_base():
+    """Remove all chunks and cached answers"""
+    global chunk_count
+
+    with ingest_lock:
+        vector_store.reset_collection()
+        answer_cache.clear()
+        chunk_count = 0
 
 
 def process_documents(file_paths: List[str]):
@@ -97,24 +349,61 @@ def process_documents(file_paths: List[str]):
     Process multiple documents into vector store.
     Generator function that yields progress messages.
     """
+    yield f"Loading {len(file_paths)} document(s)..."
+
+    # Parse files in parallel, reporting each as it finishes
+    pool = get_parse_pool()
+    futures = {pool.submit(load_document, file_path): i for i, file_path in enumerate(file_paths)}
+    results = [None] * len(file_paths)
+
+    for future in as_completed(futures):
+        i = futures[future]
+        name = Path(file_paths[i]).name
+        try:
+            results[i] = future.result()
+            yield f"✓ Loaded {name} ({len(results[i])} sections)"
+        except Exception as e:
+            results[i] = e
+            yield f"✗ Failed to load {name}: {str(e)}"
+
+    # Keep upload order for indexing
+    yield from index_documents(list(zip(file_paths, results)))
+
+
+def _generate_ids(count: int) -> List[str]:
+    """Random 128-bit hex ids, drawn from the OS RNG in a single call"""
+    raw = secrets.token_bytes(16 * count)
+    return [raw[i:i + 16].hex() for i in range(0, len(raw), 16)]
+
+
+def index_documents(loaded: List[Tuple[str, object]]):
+    """
+    Split, embed and store documents that were already loaded.
+    Takes (file_path, documents) pairs, where documents may instead be
+    the exception raised while loading that file; load results are
+    reported by the caller.
+    Generator function that yields progress messages.
+    """
     yield "Initializing AI components..."
     initialize_components()
 
+    # Hold the lock from reset through the final count so concurrent uploads
+    # and resets cannot interleave their writes
+    with ingest_lock:
+        yield from _rebuild_knowledge_base(loaded)
+
+
+def _rebuild_knowledge_base(loaded: List[Tuple[str, object]]):
+    global chunk_count
+
     yield "Clearing previous knowledge base..."
-    vector_store.reset_collection()
+    reset_knowledge_base()
 
     all_documents = []
 
-    yield f"Loading {len(file_paths)} document(s)..."
-
-    for file_path in file_paths:
-        try:
-            docs = load_document(file_path)
+    for _, docs in loaded:
+        if not isinstance(docs, Exception):
             all_documents.extend(docs)
-            yield f"✓ Loaded {Path(file_path).name} ({len(docs)} sections)"
-        except Exception as e:
-            yield f"✗ Failed to load {Path(file_path).name}: {str(e)}"
-            continue
 
     if not all_documents:
         yield "✗ No documents loaded successfully"
@@ -124,14 +413,7 @@ def process_documents(file_paths: List[str]):
     yield f"✓ Total content loaded: {total_chars:,} characters"
 
     yield "Splitting documents into semantic chunks..."
-    splitter = RecursiveCharacterTextSplitter(
-        separators=["\n\n", "\n", ". ", "! ", "? ", "; ", ", ", " "],
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP,
-        length_function=len
-    )
-
-    chunks = splitter.split_documents(all_documents)
+    chunks = text_splitter.split_documents(all_documents)
 
     if not chunks:
         yield "✗ Failed to create text chunks"
@@ -141,103 +423,140 @@ def process_documents(file_paths: List[str]):
 
     yield "Generating embeddings and storing in vector database..."
     try:
-        ids = [str(uuid4()) for _ in chunks]
-        vector_store.add_documents(documents=chunks, ids=ids)
+        texts = [chunk.page_content for chunk in chunks]
+        metadatas = [chunk.metadata for chunk in chunks]
+        ids = _generate_ids(len(chunks))
+
+        # Embed every chunk in one call so the encoder runs at full batch size
+        embeddings = vector_store._embedding_function.embed_documents(texts)
+
+        # Store precomputed vectors directly instead of re-embedding per batch
+        max_batch = vector_store._client.get_max_batch_size()
+        for start in range(0, len(ids), max_batch):
+            end = start + max_batch
+            vector_store._collection.add(
+                ids=ids[start:end],
+                embeddings=embeddings[start:end],
+                documents=texts[start:end],
+                metadatas=metadatas[start:end]
+            )
 
         # Verify storage
-        count = vector_store._collection.count()
+        count = refresh_chunk_count()
         yield f"✓ SUCCESS! Knowledge base ready with {count} chunks"
 
     except Exception as e:
+        # A partial write leaves the stored size unknown
+        chunk_count = None
         yield f"✗ Storage error: {str(e)}"
 
 
-def generate_answer(query: str):
+def select_relevant(scores: np.ndarray, threshold: float, top_k: int) -> np.ndarray:
+    """
+    Return indices of the top_k lowest distances below threshold,
+    ordered best first.
+    """
+    order = np.argsort(scores, kind="stable")
+    return order[scores[order] < threshold][:top_k]
+
+
+def _source_label(metadata: dict) -> str:
+    source_name = metadata.get('source', 'Unknown')
+    file_type = metadata.get('file_type', '')
+    return f"{source_name} ({file_type})" if file_type else source_name
+
+
+async def generate_answer(query: str):
     """
     Generate answer from knowledge base.
-    Returns (answer, sources) tuple.
+    Returns (answer, sources) tuple, with sources as a sorted list of names.
     """
     if vector_store is None:
-        raise RuntimeError("Knowledge base not initialized. Upload documents first.")
+        raise KnowledgeBaseNotReady("Knowledge base not initialized. Upload documents first.")
+
+    # Read before retrieval so a reset during the LLM call discards this answer
+    cache_generation = answer_cache.generation
+
+    cached = answer_cache.get(query)
+    if cached is not None:
+        print("DEBUG: Answer served from cache (exact match)")
+        return cached
 
     # Check vector store status
     try:
-        count = vector_store._collection.count()
+        # Only hit SQLite (off the event loop) when the cached count is unknown
+        count = chunk_count
+        if count is None:
+            count = await asyncio.to_thread(get_chunk_count)
         print(f"DEBUG: Vector store has {count} chunks")
 
         if count == 0:
             return (
                 "Knowledge base is empty. Please upload documents first.",
-                ""
+                []
             )
     except Exception as e:
         print(f"DEBUG: Error checking collection: {e}")
 
     # Retrieve relevant documents
     try:
-        docs_with_scores = vector_store.similarity_search_with_score(query, k=6)
+        query_embedding = await vector_store._embedding_function.aembed_query(query)
+
+        cached = answer_cache.search(query_embedding)
+        if cached is not None:
+            print("DEBUG: Answer served from cache (semantic match)")
+            return cached
+
+        # Query Chroma directly: results come back column-wise, one list per field
+        results = await asyncio.to_thread(
+            vector_store._collection.query,
+            query_embeddings=[query_embedding],
+            n_results=RETRIEVAL_K,
+            include=["documents", "metadatas", "distances"]
+        )
+        scores = np.asarray(results["distances"][0], dtype=np.float32)
+        texts = results["documents"][0]
+        metadatas = [metadata or {} for metadata in results["metadatas"][0]]
 
-        print(f"DEBUG: Retrieved {len(docs_with_scores)} documents")
-        for i, (doc, score) in enumerate(docs_with_scores[:3]):
-            print(f"DEBUG: Doc {i + 1} - Score: {score:.4f} - Source: {doc.metadata.get('source', 'unknown')}")
+        print(f"DEBUG: Retrieved {scores.size} documents")
+        for i in range(min(3, scores.size)):
+            print(f"DEBUG: Doc {i + 1} - Score: {scores[i]:.4f} - Source: {metadatas[i].get('source', 'unknown')}")
 
-        if not docs_with_scores:
+        if scores.size == 0:
             return (
                 "No relevant information found for your query. Try rephrasing or upload more documents.",
-                ""
+                []
             )
 
         # Filter by relevance
-        relevant_docs = [doc for doc, score in docs_with_scores if score < 2.5]
+        selected = select_relevant(scores, RELEVANCE_THRESHOLD, MAX_CONTEXT_DOCS)
 
-        if not relevant_docs:
+        if selected.size == 0:
             print("DEBUG: Using top results despite score threshold")
-            relevant_docs = [doc for doc, _ in docs_with_scores[:4]]
+            selected = np.argsort(scores, kind="stable")[:FALLBACK_DOCS]
 
     except Exception as e:
         print(f"DEBUG: Retrieval error: {e}")
-        return (f"Error searching knowledge base: {str(e)}", "")
-
-    # Build context
-    context_parts = []
-    sources = set()
+        return (f"Error searching knowledge base: {str(e)}", [])
 
-    for i, doc in enumerate(relevant_docs[:5], 1):
-        source_name = doc.metadata.get('source', 'Unknown')
-        file_type = doc.metadata.get('file_type', '')
-
-        context_parts.append(f"[Document {i}: {source_name}]\n{doc.page_content}\n")
-        sources.add(f"{source_name} ({file_type})" if file_type else source_name)
-
-    context = "\n".join(context_parts)
+    # Build context from the selected rows only
+    context = "\n".join(
+        f"[Document {n}: {metadatas[i].get('source', 'Unknown')}]\n{texts[i]}\n"
+        for n, i in enumerate(selected, 1)
+    )
+    sources = sorted({_source_label(metadatas[i]) for i in selected})
 
     # Generate answer
-    prompt = f"""You are an intelligent document assistant. Answer the question using ONLY the information from the provided documents.
-
-DOCUMENTS:
-{context}
-
-QUESTION: {query}
-
-INSTRUCTIONS:
-- Provide a clear, detailed answer based solely on the document content
-- If the documents contain the information, give a comprehensive response
-- Include specific details, numbers, or facts from the documents when relevant
-- If the information is not in the documents, clearly state: "This information is not available in the uploaded documents"
-- Do not make assumptions or add information not present in the documents
-- If multiple documents discuss the topic, synthesize the information
-
-ANSWER:"""
+    prompt = "".join((PROMPT_HEAD, context, PROMPT_MID, query, PROMPT_TAIL))
 
     try:
-        response = llm.invoke(prompt)
+        response = await llm.ainvoke(prompt)
         answer = response.content if hasattr(response, 'content') else str(response)
 
-        # Format sources
-        formatted_sources = "\n".join([f"- {src}" for src in sorted(sources)])
+        answer_cache.put(query, query_embedding, answer.strip(), sources, cache_generation)
 
-        return (answer.strip(), formatted_sources)
+        return (answer.strip(), sources)
 
     except Exception as e:
         print(f"DEBUG: LLM error: {e}")
-        return (f"Error generating answer: {str(e)}", "")
\ No newline at end of file
+        return (f"Error generating answer: {str(e)}", [])
\ No newline at end of file